@@ -1,110 +1,272 @@
+import hashlib
+import io
 import os
-import pandas as pd
+import pickle
+import numexpr as ne
+import numpy as np
+import polars as pl
 import plotly.express as px
-import plotly.io as pio
+from plotly.offline import get_plotlyjs_version
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, render_template, redirect, url_for
+from numba import config as numba_config, njit, prange
 import time
 import plotly.graph_objects as go 
 
 # --- Configuration ---
 basedir = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
+CACHE_FOLDER = os.path.join(basedir, 'cache')
 ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
+_ALLOWED_SUFFIXES = tuple(f'.{ext}' for ext in ALLOWED_EXTENSIONS)
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# The page loads plotly.js from the CDN; it must be the version the
+# installed plotly.py serializes for, or newer figure JSON features
+# (e.g. base64 'bdata' arrays) silently render as empty charts.
+app.jinja_env.globals['plotlyjs_version'] = get_plotlyjs_version()
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+
+# Processing runs on a worker pool instead of the request thread, so one
+# big upload does not stall every other request. Polars, numpy and numba
+# all release the GIL for the heavy work, so threads are enough here.
+#
+# Prefer OpenMP for numba's parallel loops: it is safe for concurrent
+# calls from multiple worker threads, and unlike TBB it does not hang
+# interpreter shutdown after a kernel has run off the main thread.
+numba_config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+executor = ThreadPoolExecutor()
 
 # --- Helper Functions ---
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    # str.endswith with a tuple is a single C-level call, vs the split +
+    # lower + set lookup this used to do.
+    return filename.lower().endswith(_ALLOWED_SUFFIXES)
+
+def _read_xlsx_fast(source):
+    """Stream the first sheet of an xlsx file into a 4-column DataFrame.
+
+    `source` is a path or a file-like object. Avoids the full openpyxl XML
+    DOM that pd.read_excel builds: python-calamine parses the sheet in a
+    single streaming pass, and the openpyxl fallback uses read-only mode
+    which also streams rows instead of materializing the tree.
+
+    All cells are emitted as strings so both ingest branches feed the same
+    string-typed cleaning pipeline that the CSV reader produces.
+    """
+    try:
+        from python_calamine import CalamineWorkbook
+        if isinstance(source, (str, os.PathLike)):
+            wb = CalamineWorkbook.from_path(source)
+        else:
+            wb = CalamineWorkbook.from_filelike(source)
+        rows = wb.get_sheet_by_index(0).to_python()
+    except ImportError:
+        from openpyxl import load_workbook
+        wb = load_workbook(source, read_only=True, data_only=True)
+        rows = wb.active.iter_rows(values_only=True, max_col=4)
+
+    dates, times, distances, speeds = [], [], [], []
+    for row in rows:
+        row = tuple(row[:4]) + (None,) * (4 - len(row[:4]))
+        dates.append(row[0]); times.append(row[1])
+        distances.append(row[2]); speeds.append(row[3])
+
+    columns = [dates, times, distances, speeds]
+    return pl.DataFrame({
+        f'column_{i + 1}': pl.Series(values, strict=False).cast(pl.Utf8, strict=False)
+        for i, values in enumerate(columns)
+    })
+
+# Day-first formats seen in the speed-monitoring exports, tried in order.
+_DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y-%m-%d')
+
+def _parse_date(expr):
+    return pl.coalesce([expr.str.to_date(fmt, strict=False) for fmt in _DATE_FORMATS])
+
+@njit(cache=True)
+def _nearest_index(cum, target):
+    """Index of the value in the sorted array `cum` closest to `target`.
+
+    Ties and duplicate runs resolve to the lowest index, matching what
+    (series - target).abs().idxmin() used to return.
+    """
+    pos = np.searchsorted(cum, target)
+    if pos >= cum.size:
+        pos = cum.size - 1
+    prev = pos - 1 if pos > 0 else 0
+    best = prev if abs(cum[prev] - target) <= abs(cum[pos] - target) else pos
+    # Step back to the first occurrence of the chosen value.
+    return np.searchsorted(cum, cum[best])
+
+@njit(cache=True, parallel=True)
+def _analyze_stops(cum, stop_indices, sample_offsets_km):
+    """Locate the pre-stop sample points for each stop, all in native code.
+
+    Returns (sample_indices, decel_start_indices) where sample_indices[k, j]
+    is the sample closest to sample_offsets_km[j] before stop k and
+    decel_start_indices[k] is the sample closest to 1 km before it.
+    Each stop is independent, so the loop runs across cores.
+    """
+    sample_indices = np.empty((stop_indices.size, sample_offsets_km.size), np.int64)
+    decel_start_indices = np.empty(stop_indices.size, np.int64)
+
+    for k in prange(stop_indices.size):
+        i = stop_indices[k]
+        for j in range(sample_offsets_km.size):
+            sample_indices[k, j] = _nearest_index(cum, cum[i] - sample_offsets_km[j])
+        decel_start_indices[k] = _nearest_index(cum, cum[i] - 1.0)
+    return sample_indices, decel_start_indices
+
+@njit(cache=True, parallel=True)
+def _fill_decel_segments(cum, speed, stop_indices, decel_start_indices, seg_offsets, rel_dist, speed_out):
+    """Fill the flat deceleration-segment buffers.
+
+    Segment k occupies [seg_offsets[k], seg_offsets[k + 1]) in the output
+    arrays; rel_dist is the distance to the stop in metres. Segments write
+    to disjoint ranges, so the loop runs across cores.
+    """
+    for k in prange(stop_indices.size):
+        out = seg_offsets[k]
+        stop_i = stop_indices[k]
+        stop_dist = cum[stop_i]
+        for i in range(decel_start_indices[k], stop_i + 1):
+            rel_dist[out] = (stop_dist - cum[i]) * 1000.0
+            speed_out[out] = speed[i]
+            out += 1
 
 def find_data_start_row(df):
-    for i, row in df.iterrows():
-        try:
-            pd.to_datetime(row.iloc[0], dayfirst=True)
-            return i
-        except (ValueError, TypeError):
-            continue
-    return -1
+    # One vectorized parse of the whole first column beats checking one
+    # row at a time: unparseable header rows become null.
+    valid = df.select(_parse_date(pl.first()).is_not_null().alias('valid'))['valid']
+    return valid.arg_max() if valid.any() else -1
 
 # --- Core Data Processing Logic ---
-def process_file(file_path):
+def process_file(file_source, filename=None):
+    """Analyze a telemetry file.
+
+    `file_source` is either a path on disk or the raw uploaded bytes (the
+    upload handler already holds them for hashing, so parsing straight
+    from memory avoids a write + read-back round trip through the
+    filesystem). `filename` is only needed for the bytes form.
+    """
     start_time = time.time()
-    filename = os.path.basename(file_path)
+    if filename is None:
+        filename = os.path.basename(file_source)
+    source = io.BytesIO(file_source) if isinstance(file_source, bytes) else file_source
     print(f"[{start_time:.2f}] --- Starting file processing for: {filename} ---")
 
     try:
         if filename.lower().endswith('.csv'):
-            df = pd.read_csv(file_path, header=None, low_memory=False)
+            # infer_schema_length=0 reads every column as a string, so both
+            # ingest branches feed the same cleaning pipeline.
+            df = pl.read_csv(source, has_header=False, infer_schema_length=0)
         else:
-            df = pd.read_excel(file_path, header=None, usecols='A:D')
+            df = _read_xlsx_fast(source)
     except Exception as e:
         return {'error': f"Error reading file. It might be corrupted or in an unexpected format. Details: {e}"}
 
     t_after_read = time.time()
-    print(f"[{t_after_read:.2f}] File read into pandas DataFrame. Time taken: {t_after_read - start_time:.2f}s")
+    print(f"[{t_after_read:.2f}] File read into Polars DataFrame. Time taken: {t_after_read - start_time:.2f}s")
 
     start_row = find_data_start_row(df)
-    
+
     if start_row == -1:
         return {'error': "Could not find a valid data start row (with a date) in the file."}
 
-    df = df.iloc[start_row:].reset_index(drop=True)
-    data_df = df.copy()
-    data_df.columns = ['DATE', 'TIME', 'DISTANCE', 'SPEED']
-    
-    for col in ['DISTANCE', 'SPEED']:
-        data_df[col] = pd.to_numeric(data_df[col], errors='coerce')
-
-    data_df.dropna(subset=['DATE', 'TIME', 'DISTANCE', 'SPEED'], inplace=True)
-    if data_df.empty:
+    # Parse DATE and TIME separately and combine them, instead of building a
+    # throwaway "date time" Python string per row for one combined parse.
+    # The whole chain runs lazily so Polars fuses the slice, projection and
+    # casts into one pass instead of materializing each intermediate frame.
+    data_df = (
+        df.lazy()
+        .slice(start_row)
+        .select(df.columns[:4])
+        .rename(dict(zip(df.columns[:4], ['DATE', 'TIME', 'DISTANCE', 'SPEED'])))
+        .with_columns([
+            _parse_date(pl.col('DATE')).alias('DATE'),
+            pl.col('TIME').str.to_time('%H:%M:%S', strict=False).alias('TIME'),
+            # float32 is plenty for the reported precision (0.01 km, whole
+            # Kmph) and halves the bandwidth of every downstream kernel.
+            pl.col('DISTANCE').cast(pl.Float32, strict=False),
+            pl.col('SPEED').cast(pl.Float32, strict=False),
+        ])
+        .drop_nulls(['DATE', 'TIME', 'DISTANCE', 'SPEED'])
+        .with_columns(pl.col('DATE').dt.combine(pl.col('TIME')).alias('DATETIME'))
+        .collect()
+    )
+    if data_df.is_empty():
         return {'error': "No valid data rows found after cleaning."}
 
-    data_df['DATETIME'] = pd.to_datetime(data_df['DATE'].astype(str) + ' ' + data_df['TIME'].astype(str), dayfirst=True)
-    data_df['CUMULATIVE_DISTANCE'] = data_df['DISTANCE'].cumsum() / 1000
-    
+    # Cumulative distance in km: cumsum into a preallocated buffer and an
+    # in-place scale, instead of a Series cumsum plus a second full-array
+    # divide that each allocate their own intermediate. The accumulator
+    # stays float64 so rounding never drifts over long journeys.
+    cum = np.empty(data_df.height)
+    np.cumsum(data_df['DISTANCE'].to_numpy(), out=cum)
+    cum *= 0.001
+
     t_after_clean = time.time()
     print(f"[{t_after_clean:.2f}] Data cleaning and prep complete. Time taken: {t_after_clean - t_after_read:.2f}s")
 
     # --- Metrics and Analysis ---
     stop_analysis_results = []
-    stop_events = data_df[(data_df['SPEED'] == 0) & (data_df['SPEED'].shift(1) > 0)]
     points_before_stop = []
-    deceleration_data_frames = [] 
+    stop_time_labels = []
 
-    for index, stop_row in stop_events.iterrows():
-        stop_dist = stop_row['CUMULATIVE_DISTANCE']; stop_time = stop_row['DATETIME']
+    speed_arr = data_df['SPEED'].to_numpy()
+    datetimes = data_df['DATETIME']
+
+    # A stop is the first zero-speed sample after a moving sample. numexpr
+    # fuses the two comparisons and the AND into one pass over the arrays
+    # instead of allocating a boolean intermediate per comparison.
+    speed_prev = np.empty_like(speed_arr)
+    speed_prev[0] = 0.0
+    speed_prev[1:] = speed_arr[:-1]
+    stop_indices = np.flatnonzero(ne.evaluate('(speed_arr == 0) & (speed_prev > 0)'))
+
+    # Cumulative distance is monotonically non-decreasing, so every
+    # "closest sample to X metres before the stop" lookup is a binary
+    # search; the lookup pass runs JIT-compiled.
+    sample_offsets_km = np.array([0.001, 0.010, 0.050, 0.100])
+    sample_indices, decel_start_indices = _analyze_stops(cum, stop_indices, sample_offsets_km)
+
+    # All deceleration segments live in two flat preallocated buffers with
+    # offset bookkeeping - one allocation for the whole plot instead of a
+    # per-stop array pair. Distance is *to* the stop so the plot axis can
+    # be reversed.
+    decel_seg_offsets = np.zeros(stop_indices.size + 1, dtype=np.int64)
+    np.cumsum(stop_indices - decel_start_indices + 1, out=decel_seg_offsets[1:])
+    decel_rel_dist = np.empty(decel_seg_offsets[-1], dtype=np.float32)
+    decel_speed = np.empty(decel_seg_offsets[-1], dtype=np.float32)
+    _fill_decel_segments(cum, speed_arr, stop_indices, decel_start_indices,
+                         decel_seg_offsets, decel_rel_dist, decel_speed)
+
+    for k, stop_index in enumerate(stop_indices):
+        stop_index = int(stop_index)
+        stop_dist = cum[stop_index]; stop_time = datetimes[stop_index]
         stop_time_str = stop_time.strftime('%H:%M:%S')
+        stop_time_labels.append(stop_time_str)
         stop_analysis_results.append(f"\nStop detected at {stop_dist:.2f} km (Time: {stop_time_str}).\n")
-        
-        target_dist_1km_before = stop_dist - 1.0 
-        pre_stop_data = data_df.loc[:index].copy() 
-        start_index = (pre_stop_data['CUMULATIVE_DISTANCE'] - target_dist_1km_before).abs().idxmin()
-        
-        decel_segment = data_df.loc[start_index:index].copy()
-        
-        # --- NEW LOGIC FOR REVERSED AXIS ---
-        # Instead of distance *from* 1km ago, we calculate distance *to* the stop
-        decel_segment['DISTANCE_TO_STOP'] = (stop_dist - decel_segment['CUMULATIVE_DISTANCE']) * 1000 # in meters
-        decel_segment['STOP_TIME'] = stop_time_str
-        deceleration_data_frames.append(decel_segment)
-        
-        for meters_before in [1, 10, 50, 100]:
+
+        for j, meters_before in enumerate([1, 10, 50, 100]):
             target_dist = stop_dist - (meters_before / 1000.0)
             if target_dist > 0:
-                closest_idx = (pre_stop_data['CUMULATIVE_DISTANCE'] - target_dist).abs().idxmin()
-                speed = pre_stop_data.loc[closest_idx, 'SPEED']; dist = pre_stop_data.loc[closest_idx, 'CUMULATIVE_DISTANCE']; time_before = pre_stop_data.loc[closest_idx, 'DATETIME']
+                closest_idx = int(sample_indices[k, j])
+                speed = speed_arr[closest_idx]; dist = cum[closest_idx]; time_before = datetimes[closest_idx]
                 stop_analysis_results.append(f"  - Speed ~{meters_before}m before: {speed} Kmph (at {dist:.2f} km, Time: {time_before.strftime('%H:%M:%S')}) \n")
                 points_before_stop.append((dist, speed))
 
     t_after_analysis = time.time()
     print(f"[{t_after_analysis:.2f}] Stop/Metric analysis complete. Time taken: {t_after_analysis - t_after_clean:.2f}s")
     
-    total_distance = data_df['CUMULATIVE_DISTANCE'].iloc[-1]; max_speed = data_df['SPEED'].max()
-    max_speed_idx = data_df['SPEED'].idxmax()
-    dist_at_max_speed = data_df.loc[max_speed_idx, 'CUMULATIVE_DISTANCE']; time_at_max_speed = data_df.loc[max_speed_idx, 'DATETIME']
+    total_distance = cum[-1]; max_speed = speed_arr.max()
+    max_speed_idx = int(speed_arr.argmax())
+    dist_at_max_speed = cum[max_speed_idx]; time_at_max_speed = datetimes[max_speed_idx]
 
     metrics = {
         'total_distance': f"{total_distance:.2f} km", 'max_speed': f"{max_speed} Kmph",
@@ -112,51 +274,65 @@ def process_file(file_path):
     }
 
     # --- Data Downsampling for Plotting ---
-    plot_df = data_df.set_index('DATETIME')
-    plot_df = plot_df.resample('10S').mean(numeric_only=True).reset_index()
-    plot_df.dropna(inplace=True)
+    # Both plots are downsampled with the same numpy binning pass: group
+    # samples into bins, then mean speed per bin is one bincount ratio.
+    # Empty bins simply never appear, like resample().mean() + dropna did.
+    t_sec = data_df['DATETIME'].to_numpy().astype('datetime64[s]').astype(np.int64)
+    time_bin_ids, time_bin_inverse = np.unique(t_sec // 10, return_inverse=True)
+    time_bin_speed = (np.bincount(time_bin_inverse, weights=speed_arr) / np.bincount(time_bin_inverse)).astype(np.float32)
+    time_bin_starts = (time_bin_ids * 10).astype('datetime64[s]')
+
+    dist_bin_ids, dist_bin_inverse = np.unique((cum / 0.01).astype(np.int64), return_inverse=True)
+    dist_bin_speed = (np.bincount(dist_bin_inverse, weights=speed_arr) / np.bincount(dist_bin_inverse)).astype(np.float32)
+    dist_bin_starts = (dist_bin_ids * 0.01).astype(np.float32)
+
     t_after_resample = time.time()
-    print(f"[{t_after_resample:.2f}] Data resampled for plotting. Time taken: {t_after_resample - t_after_analysis:.2f}s")
-    
+    print(f"[{t_after_resample:.2f}] Data downsampled for plotting. Time taken: {t_after_resample - t_after_analysis:.2f}s")
+
     # Plot 1: Speed vs. Time (General)
-    fig_time_speed = px.line(plot_df, x='DATETIME', y='SPEED', title="Speed vs. Time (Resampled to 10s intervals)", labels={'DATETIME': 'Time', 'SPEED': 'Speed (Kmph)'})
-    graph1_html = pio.to_html(fig_time_speed, full_html=False)
+    fig_time_speed = px.line(x=time_bin_starts, y=time_bin_speed, title="Speed vs. Time (Resampled to 10s intervals)", labels={'x': 'Time', 'y': 'Speed (Kmph)'})
+    graph1_json = fig_time_speed.to_json()
     t_after_graph1 = time.time()
     print(f"[{t_after_graph1:.2f}] Graph 1 generated. Time taken: {t_after_graph1 - t_after_resample:.2f}s")
-    
-    # Plot 2: Speed vs. Cumulative Distance (General)
-    fig_dist_speed = px.line(data_df, x='CUMULATIVE_DISTANCE', y='SPEED', title="Speed vs. Cumulative Distance", labels={'CUMULATIVE_DISTANCE': 'Cumulative Distance (Km)', 'SPEED': 'Speed (Kmph)'})
+
+    # Plot 2: Speed vs. Cumulative Distance (10m bins)
+    fig_dist_speed = px.line(x=dist_bin_starts, y=dist_bin_speed, title="Speed vs. Cumulative Distance", labels={'x': 'Cumulative Distance (Km)', 'y': 'Speed (Kmph)'})
     if points_before_stop:
         dists, speeds = zip(*points_before_stop)
         fig_dist_speed.add_scatter(x=dists, y=speeds, mode='markers', marker=dict(color='red', size=8), name='Speed Before Stop')
-    graph2_html = pio.to_html(fig_dist_speed, full_html=False)
+    graph2_json = fig_dist_speed.to_json()
     t_after_graph2 = time.time()
     print(f"[{t_after_graph2:.2f}] Graph 2 generated. Time taken: {t_after_graph2 - t_after_graph1:.2f}s")
     
     # Plot 3: Deceleration Profile
-    decel_plot_html = ""
+    decel_plot_json = ""
     t_before_decel_plot = time.time()
-    if deceleration_data_frames:
-        fig_decel = go.Figure()
-        
-        for df_segment in deceleration_data_frames:
-            fig_decel.add_trace(go.Scatter(
-                # --- MODIFIED: Use the new DISTANCE_TO_STOP column ---
-                x=df_segment['DISTANCE_TO_STOP'],
-                y=df_segment['SPEED'],
-                mode='lines',
-                name=f"Stop at {df_segment['STOP_TIME'].iloc[0]}"
-            ))
+    if stop_indices.size:
+        # One trace for all segments: a NaN separator after each segment
+        # breaks the line, so Plotly serializes and renders O(1) traces
+        # instead of one per stop. The stop time rides along as hovertext.
+        xs = np.insert(decel_rel_dist, decel_seg_offsets[1:], np.nan)
+        ys = np.insert(decel_speed, decel_seg_offsets[1:], np.nan)
+        hover = np.repeat(np.array(stop_time_labels, dtype=object),
+                          np.diff(decel_seg_offsets) + 1)
+
+        fig_decel = go.Figure(go.Scatter(
+            x=xs,
+            y=ys,
+            mode='lines',
+            hovertext=hover.tolist(),
+            hovertemplate='%{x:.1f} m, %{y} Kmph<br>Stop at %{hovertext}<extra></extra>',
+            showlegend=False
+        ))
 
         fig_decel.update_layout(
             title="Deceleration Profile (1000m Before Stop)",
             xaxis_title="Distance To Stop (meters)",
             yaxis_title="Speed (Kmph)",
-            legend_title="Stop Time",
             # --- THIS IS THE KEY LINE FOR THE FIX ---
             xaxis_autorange='reversed'
         )
-        decel_plot_html = pio.to_html(fig_decel, full_html=False)
+        decel_plot_json = fig_decel.to_json()
 
     t_after_decel_plot = time.time()
     print(f"[{t_after_decel_plot:.2f}] Graph 3 (Decel Profile) generated. Time taken: {t_after_decel_plot - t_after_graph2:.2f}s")
@@ -166,10 +342,14 @@ def process_file(file_path):
 
     return {
         'metrics': metrics, 'stop_analysis': stop_analysis_results,
-        'graph1_html': graph1_html, 'graph2_html': graph2_html,
-        'decel_plot_html': decel_plot_html 
+        'graph1_json': graph1_json, 'graph2_json': graph2_json,
+        'decel_plot_json': decel_plot_json
     }
 
+def _persist_upload(filepath, file_bytes):
+    with open(filepath, 'wb') as f:
+        f.write(file_bytes)
+
 # --- Flask Routes (Unchanged) ---
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
@@ -180,9 +360,27 @@ def upload_file():
         if file and allowed_file(file.filename):
             from werkzeug.utils import secure_filename
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            results = process_file(filepath)
+            file_bytes = file.read()
+
+            # Results are cached by content hash, so re-uploading the same
+            # file skips the whole pipeline. hashlib's SHA-256 is
+            # OpenSSL-backed and hardware-accelerated on modern CPUs, so
+            # hashing is never the bottleneck.
+            digest = hashlib.sha256(file_bytes).hexdigest()
+            cache_path = os.path.join(CACHE_FOLDER, f"{digest}.pkl")
+            if os.path.exists(cache_path):
+                with open(cache_path, 'rb') as f:
+                    results = pickle.load(f)
+            else:
+                # Parse straight from the in-memory upload; the copy kept
+                # under uploads/ is written in the background so the
+                # request never waits on the filesystem.
+                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                executor.submit(_persist_upload, filepath, file_bytes)
+                results = executor.submit(process_file, file_bytes, filename).result()
+                if 'error' not in results:
+                    with open(cache_path, 'wb') as f:
+                        pickle.dump(results, f)
             return render_template('index.html', results=results, filename=filename)
     return render_template('index.html', results=None)
 